@@ -3,11 +3,26 @@ import os
 
 CONFIG_FILE_PATH = "config.json"  # At the root of the project
 
+def _read_config() -> dict:
+    """Returns the current config contents, or an empty dict if missing/unreadable."""
+    try:
+        with open(CONFIG_FILE_PATH, 'r', encoding='utf-8') as f:
+            config_data = json.load(f)
+            return config_data if isinstance(config_data, dict) else {}
+    except Exception:
+        return {}
+
+def _update_config(values: dict):
+    """Merges values into the config file so other settings are kept."""
+    config_data = _read_config()
+    config_data.update(values)
+    with open(CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(config_data, f, ensure_ascii=False, indent=4)
+
 def save_api_key(api_key: str):
     """Saves the API key to the config file."""
     try:
-        with open(CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump({"api_key": api_key}, f, ensure_ascii=False, indent=4)
+        _update_config({"api_key": api_key})
         print(f"API Key saved to {CONFIG_FILE_PATH}")
         return True
     except Exception as e:
@@ -40,6 +55,24 @@ def load_api_key() -> str | None:
         print(f"Error loading API Key from {CONFIG_FILE_PATH}: {e}")
         return None
 
+def save_sync_settings(server_url: str, user_id: str, enabled: bool):
+    """Saves the stats server settings used to share statistics with other players."""
+    try:
+        _update_config({"sync": {"server_url": server_url, "user_id": user_id, "enabled": enabled}})
+        print(f"Sync settings saved to {CONFIG_FILE_PATH}")
+        return True
+    except Exception as e:
+        print(f"Error saving sync settings to {CONFIG_FILE_PATH}: {e}")
+        return False
+
+def load_sync_settings() -> dict:
+    """Loads the stats server settings, falling back to defaults (sync disabled)."""
+    sync = _read_config().get("sync")
+    settings = {"server_url": "http://127.0.0.1:8765", "user_id": "", "enabled": False}
+    if isinstance(sync, dict):
+        settings.update({key: sync[key] for key in settings if key in sync})
+    return settings
+
 if __name__ == '__main__':
     # Test saving
     print("Testing config_manager.py...")
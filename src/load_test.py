@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+from attributes import ATTRIBUTE_DATA
+from stats_protocol import MAX_ROLLS_PER_ATTRIBUTE
+from stats_server import DEFAULT_HOST, DEFAULT_PORT, serve
+
+SPAWN_PORT = 18765  # Away from DEFAULT_PORT so a spawned instance never collides with a real one
+
+
+class KeepAliveClient:
+    """Minimal HTTP/1.1 client over one persistent connection, so the test measures the server, not connection setup."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict | None = None):
+        """Returns (status, headers, body)."""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        if body:
+            lines.append("Content-Type: application/json")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('utf-8') + body)
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        head_lines = head.decode('latin-1').split("\r\n")
+        status = int(head_lines[0].split(" ")[1])
+        response_headers = {}
+        for line in head_lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+        length = int(response_headers.get("content-length", "0"))
+        response_body = await self.reader.readexactly(length) if length else b""
+        return status, response_headers, response_body
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def random_rolls() -> dict:
+    rolls = {}
+    for attr in random.sample(list(ATTRIBUTE_DATA), k=random.randint(1, 4)):
+        rolls[attr] = random.randint(1, MAX_ROLLS_PER_ATTRIBUTE)
+    return rolls
+
+
+async def run_client(client_id: int, host: str, port: int, num_requests: int, read_ratio: float, results: dict):
+    client = KeepAliveClient(host, port)
+    user_id = f"load-test-{client_id}"
+    etag = None
+    try:
+        await client.connect()
+        for _ in range(num_requests):
+            started = time.perf_counter()
+            if random.random() < read_ratio:
+                kind = "read"
+                headers = {"If-None-Match": etag} if etag else {}
+                status, response_headers, _ = await client.request("GET", "/stats", headers=headers)
+                etag = response_headers.get("etag", etag)
+                if status == 304:
+                    results["not_modified"] += 1
+            else:
+                kind = "write"
+                body = json.dumps({"user": user_id, "rolls": random_rolls()}, ensure_ascii=False).encode('utf-8')
+                status, _, response_body = await client.request("POST", "/rolls", body=body)
+                if status == 200:
+                    results["accepted"] += json.loads(response_body)["accepted"]
+            results["latencies"][kind].append(time.perf_counter() - started)
+            if status not in (200, 304):
+                results["errors"] += 1
+    except (OSError, asyncio.IncompleteReadError) as e:
+        results["errors"] += 1
+        results["connection_errors"].append(str(e))
+    finally:
+        await client.close()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_load_test(host: str, port: int, clients: int, num_requests: int, read_ratio: float,
+                        check_totals: bool) -> bool:
+    """Returns False if any request failed or (with check_totals) the aggregate lost or doubled writes."""
+    results = {"latencies": {"read": [], "write": []}, "errors": 0, "not_modified": 0,
+               "accepted": 0, "connection_errors": []}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(i, host, port, num_requests, read_ratio, results) for i in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in results["latencies"].values())
+    print(f"\n--- Load test: {clients} concurrent clients x {num_requests} requests ---")
+    print(f"  Completed requests: {total} in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+    for kind, values in results["latencies"].items():
+        if values:
+            print(f"  {kind:5s}: {len(values)} requests, "
+                  f"p50 {percentile(values, 50) * 1000:.1f}ms, "
+                  f"p95 {percentile(values, 95) * 1000:.1f}ms, "
+                  f"p99 {percentile(values, 99) * 1000:.1f}ms")
+    print(f"  304 Not Modified responses: {results['not_modified']}")
+    print(f"  Errors: {results['errors']}")
+    for message in results["connection_errors"][:5]:
+        print(f"    {message}")
+
+    client = KeepAliveClient(host, port)
+    await client.connect()
+    _, _, body = await client.request("GET", "/stats")
+    _, _, user_body = await client.request("GET", f"/stats/users/{quote('load-test-0')}")
+    await client.close()
+    aggregate = json.loads(body)
+    print(f"  Server aggregate: {aggregate['total']} attributes from {aggregate['users']} users")
+    print(f"  Sample user: {json.loads(user_body).get('total', 0)} attributes")
+    print(f"  Accepted by /rolls: {results['accepted']} attributes")
+
+    passed = results["errors"] == 0
+    # Only a spawned server is guaranteed to start empty with no other writers
+    if check_totals and aggregate["total"] != results["accepted"]:
+        print(f"  FAILED: aggregate total {aggregate['total']} != accepted {results['accepted']} "
+              "(writes were lost or applied twice)")
+        passed = False
+    print("  Result: " + ("PASSED" if passed else "FAILED"))
+    return passed
+
+
+async def main_async(args) -> bool:
+    if args.existing:
+        return await run_load_test(args.host, args.port or DEFAULT_PORT, args.clients, args.requests,
+                                   args.read_ratio, check_totals=False)
+
+    # Local instance with a throwaway snapshot dir so real statistics are untouched
+    port = args.port or SPAWN_PORT
+    with tempfile.TemporaryDirectory(prefix="echo_stats_load_") as snapshot_dir:
+        ready = asyncio.Event()
+        server_task = asyncio.create_task(serve(args.host, port, snapshot_dir=snapshot_dir,
+                                                snapshot_interval=1.0, ready=ready))
+        ready_task = asyncio.create_task(ready.wait())
+        await asyncio.wait([server_task, ready_task], return_when=asyncio.FIRST_COMPLETED)
+        if server_task.done():
+            ready_task.cancel()
+            server_task.result()  # Raises the bind error, e.g. port already in use
+        try:
+            return await run_load_test(args.host, port, args.clients, args.requests,
+                                       args.read_ratio, check_totals=True)
+        finally:
+            server_task.cancel()
+            try:
+                await server_task
+            except asyncio.CancelledError:
+                pass
+
+
+def raise_open_file_limit():
+    # Each client holds a socket (twice over when the server is spawned in-process); the usual soft limit of 1024 is too low
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Could not raise open file limit: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the echo stats aggregation server.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=None,
+                        help=f"Defaults to {SPAWN_PORT} for the spawned server, {DEFAULT_PORT} with --existing")
+    parser.add_argument("--clients", type=int, default=2000, help="Concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    parser.add_argument("--read-ratio", type=float, default=0.3, help="Share of requests that GET /stats")
+    parser.add_argument("--existing", action="store_true",
+                        help="Target an already running server instead of spawning a scratch one. "
+                             "This writes fake load-test-N users into that server's statistics.")
+    args = parser.parse_args()
+
+    raise_open_file_limit()
+    if not asyncio.run(main_async(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
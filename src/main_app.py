@@ -7,16 +7,21 @@ from attribute_parser import parse_ocr_text
 from collections import defaultdict
 import json
 import os
-from config_manager import load_api_key, save_api_key # New import
+from config_manager import load_api_key, save_api_key, load_sync_settings, save_sync_settings
+from stats_client import push_batches, split_into_batches, fetch_stats
+from stats_protocol import check_user_id
 
 STATS_FILE_PATH = "data/echo_stats.json"
+# What each server already has; only ever written together with STATS_FILE_PATH so the two can't drift
+SYNCED_STATS_FILE_PATH = "data/echo_stats_synced.json"
+SYNC_QUEUE_FILE_PATH = "data/sync_queue.json" # Batches not yet accepted by the server
 
 class MainApp(ctk.CTk):
     def __init__(self):
         super().__init__()
 
         self.title("鸣潮声骸词条统计器")
-        self.geometry("800x750") # Increased height for API key input
+        self.geometry("800x800") # Increased height for API key and sync inputs
         self.image_path = None
         self.attribute_statistics = defaultdict(int)
 
@@ -29,6 +34,12 @@ class MainApp(ctk.CTk):
 
         self.load_statistics() # Load attribute statistics
 
+        # Stats server sync settings; the aggregate is cached with its ETag
+        self.sync_settings = load_sync_settings()
+        self.server_stats = None
+        self.server_stats_etag = None
+        self.load_sync_queue()
+
         # --- API Key Configuration Frame ---
         api_key_frame = ctk.CTkFrame(self)
         api_key_frame.pack(pady=(10,0), padx=10, fill="x")
@@ -41,6 +52,33 @@ class MainApp(ctk.CTk):
         self.save_api_key_button = ctk.CTkButton(api_key_frame, text="保存 API Key", command=self.gui_save_api_key)
         self.save_api_key_button.pack(side="left", padx=(0,5))
 
+        # --- Stats Server Sync Frame ---
+        sync_frame = ctk.CTkFrame(self)
+        sync_frame.pack(pady=(10,0), padx=10, fill="x")
+
+        ctk.CTkLabel(sync_frame, text="统计服务器:").pack(side="left", padx=(5,5))
+        self.server_url_entry = ctk.CTkEntry(sync_frame, width=200)
+        self.server_url_entry.pack(side="left", padx=(0,5), expand=True, fill="x")
+        self.server_url_entry.insert(0, self.sync_settings["server_url"])
+
+        ctk.CTkLabel(sync_frame, text="用户名:").pack(side="left", padx=(0,5))
+        self.user_id_entry = ctk.CTkEntry(sync_frame, width=100)
+        self.user_id_entry.pack(side="left", padx=(0,5))
+        self.user_id_entry.insert(0, self.sync_settings["user_id"])
+
+        self.sync_enabled_var = ctk.BooleanVar(value=self.sync_settings["enabled"])
+        self.sync_checkbox = ctk.CTkCheckBox(sync_frame, text="同步", variable=self.sync_enabled_var, width=60)
+        self.sync_checkbox.pack(side="left", padx=(0,5))
+
+        self.save_sync_button = ctk.CTkButton(sync_frame, text="保存", width=60, command=self.gui_save_sync_settings)
+        self.save_sync_button.pack(side="left", padx=(0,5))
+
+        self.server_stats_button = ctk.CTkButton(sync_frame, text="全服统计", width=80, command=self.show_server_statistics)
+        self.server_stats_button.pack(side="left", padx=(0,5))
+
+        self.upload_local_button = ctk.CTkButton(sync_frame, text="上传本地统计", width=100, command=self.upload_local_statistics)
+        self.upload_local_button.pack(side="left", padx=(0,5))
+
         # --- Top Controls Frame (Image Load, Stats Save/Clear) ---
         top_controls_frame = ctk.CTkFrame(self)
         top_controls_frame.pack(pady=10, padx=10, fill="x")
@@ -91,6 +129,133 @@ class MainApp(ctk.CTk):
             self.status_bar.configure(text="API Key 保存失败。(Failed to save API Key.)")
             messagebox.showerror("API Key Error", "Failed to save API Key. Check console for details.")
 
+    def gui_save_sync_settings(self):
+        server_url = self.server_url_entry.get().strip()
+        user_id = self.user_id_entry.get().strip()
+        enabled = self.sync_enabled_var.get()
+        if enabled and (not server_url or not user_id):
+            self.status_bar.configure(text="同步需要服务器地址和用户名。(Server URL and user name are required for sync.)")
+            messagebox.showwarning("Sync Error", "Server URL and user name are required to enable sync.")
+            return
+        user_id_error = check_user_id(user_id) if user_id else None
+        if user_id_error: # Same check as the server, which would otherwise refuse every sync
+            self.status_bar.configure(text=f"用户名无效。(Invalid user name: {user_id_error})")
+            messagebox.showwarning("Sync Error", f"Invalid user name: {user_id_error}")
+            return
+
+        if save_sync_settings(server_url, user_id, enabled):
+            self.sync_settings = {"server_url": server_url, "user_id": user_id, "enabled": enabled}
+            self.server_stats = None # Different server or user, drop the cached aggregate
+            self.server_stats_etag = None
+            suffix = self.flush_sync_queue() if enabled and self.sync_queue else ""
+            self.status_bar.configure(text="同步设置已保存。(Sync settings saved.)" + suffix)
+        else:
+            self.status_bar.configure(text="同步设置保存失败。(Failed to save sync settings.)")
+            messagebox.showerror("Sync Error", "Failed to save sync settings. Check console for details.")
+
+    def sync_key(self):
+        return f"{self.sync_settings['server_url']}|{self.sync_settings['user_id']}"
+
+    def queue_for_sync(self, batches):
+        """
+        Queues batches for the configured server/user and counts them as synced there.
+        Local statistics are saved along with the synced counts, so after a restart
+        the two still agree on what the server has.
+        """
+        synced = self.synced_statistics.setdefault(self.sync_key(), {})
+        for batch in batches:
+            self.sync_queue.append({"server_url": self.sync_settings["server_url"],
+                                    "user": self.sync_settings["user_id"], "rolls": batch})
+            for attr, count in batch.items():
+                synced[attr] = synced.get(attr, 0) + count
+        self.save_sync_queue()
+        self.persist_synced_statistics()
+
+    def flush_sync_queue(self):
+        """Sends queued batches in order, keeping whatever fails for the next sync. Returns a status suffix."""
+        error = None
+        while self.sync_queue:
+            head = self.sync_queue[0]
+            run = []
+            for entry in self.sync_queue:
+                if entry["server_url"] != head["server_url"] or entry["user"] != head["user"]:
+                    break
+                run.append(entry["rolls"])
+            handled, rejected, error = push_batches(head["server_url"], head["user"], run)
+            del self.sync_queue[:handled]
+            if rejected:
+                # Not applied by the server, so no longer counted as synced; "上传本地统计" can resend them
+                print(f"Stats server rejected {len(rejected)} batches: {error}")
+                synced = self.synced_statistics.setdefault(f"{head['server_url']}|{head['user']}", {})
+                for batch in rejected:
+                    for attr, count in batch.items():
+                        synced[attr] = max(0, synced.get(attr, 0) - count)
+                self.persist_synced_statistics()
+            if handled < len(run):
+                break
+        self.save_sync_queue()
+
+        if error:
+            print(f"Error syncing statistics: {error}")
+            if self.sync_queue:
+                return f" 同步失败，{len(self.sync_queue)} 批待重试: {error}"
+            return f" 同步失败: {error}"
+        return " 已同步到服务器。"
+
+    def sync_rolls(self, found_attributes):
+        """Queues one image's attributes and flushes the queue if sync is enabled. Returns a status suffix."""
+        if not self.sync_settings["enabled"]:
+            return ""
+        self.queue_for_sync(split_into_batches(found_attributes))
+        return self.flush_sync_queue()
+
+    def upload_local_statistics(self):
+        """Uploads locally recorded statistics that the configured server doesn't have yet."""
+        server_url = self.sync_settings["server_url"]
+        user_id = self.sync_settings["user_id"]
+        if not server_url or not user_id:
+            self.status_bar.configure(text="错误: 请先保存服务器地址和用户名。(Error: Please save the server URL and user name first.)")
+            messagebox.showwarning("Sync Error", "Save the server URL and user name before uploading.")
+            return
+
+        synced = self.synced_statistics.get(self.sync_key(), {})
+        unsynced = {attr: count - synced.get(attr, 0) for attr, count in self.attribute_statistics.items()
+                    if count > synced.get(attr, 0)}
+        if not unsynced:
+            self.status_bar.configure(text="本地统计已全部上传。(Local statistics are already uploaded.)" + self.flush_sync_queue())
+            return
+        if not messagebox.askyesno("Upload Statistics",
+                                   f"Upload {sum(unsynced.values())} locally recorded attributes to {server_url} as {user_id}?"):
+            return
+
+        self.queue_for_sync(split_into_batches(unsynced))
+        self.status_bar.configure(text="本地统计已加入上传队列。" + self.flush_sync_queue())
+
+    def show_server_statistics(self):
+        server_url = self.server_url_entry.get().strip()
+        if not server_url:
+            self.status_bar.configure(text="错误: 请先填写统计服务器地址。(Error: Please enter the stats server URL.)")
+            return
+
+        self.status_bar.configure(text="正在获取全服统计...")
+        self.update()
+        data, etag, error = fetch_stats(server_url, etag=self.server_stats_etag)
+        if error:
+            self.status_bar.configure(text=f"获取全服统计失败: {error}")
+            return
+        if data is not None: # None means 304, the cached copy is still current
+            self.server_stats = data
+            self.server_stats_etag = etag
+
+        display_text = f"--- 全服词条统计 (Server-wide Attribute Statistics, {self.server_stats.get('users', 0)} users) ---\n"
+        for attr, entry in self.server_stats["attributes"].items():
+            display_text += f"  {attr}: {entry['count']} ({entry['percentage']:.2f}%)\n"
+        display_text += f"\n--- 总计 (Total) ---\n  所有词条总数 (Total number of all attributes): {self.server_stats['total']}\n"
+
+        self.stats_display.delete("0.0", "end")
+        self.stats_display.insert("0.0", display_text)
+        self.status_bar.configure(text="已获取全服统计。")
+
     def trigger_image_processing(self):
         if self.api_key == "YOUR_API_KEY_HERE" or not self.api_key:
             self.status_bar.configure(text="错误: 请先配置有效的 API Key。(Error: Please configure a valid API Key.)")
@@ -148,7 +313,7 @@ class MainApp(ctk.CTk):
                     self.attribute_statistics[attr] += count
                     current_image_summary.append(f"{attr}: {count}")
                 self.stats_display.insert("end", f"本次识别到的词条 (Attributes found in this image):\n  {', '.join(current_image_summary)}\n\n")
-                self.status_bar.configure(text="识别成功！已更新统计数据。")
+                self.status_bar.configure(text="识别成功！已更新统计数据。" + self.sync_rolls(found_attributes_in_image))
 
             self.update_stats_display(from_process=True)
         else:
@@ -188,19 +353,34 @@ class MainApp(ctk.CTk):
 
     def clear_statistics(self):
         self.attribute_statistics.clear()
+        # Nothing local is left to upload; queued batches are still sent. Like the
+        # local statistics, this only reaches disk on the next save or sync.
+        self.synced_statistics.clear()
         self.image_path = None
         self.image_display_label.configure(text="No image selected.")
         self.update_stats_display()
         self.status_bar.configure(text="统计数据已清空.")
         print("Statistics cleared.")
 
+    def write_statistics_files(self):
+        """Writes the local statistics and the per-server synced counts together."""
+        data_dir = os.path.dirname(STATS_FILE_PATH)
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir, exist_ok=True)
+        with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(self.attribute_statistics, f, ensure_ascii=False, indent=4)
+        with open(SYNCED_STATS_FILE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(self.synced_statistics, f, ensure_ascii=False, indent=4)
+
+    def persist_synced_statistics(self):
+        try:
+            self.write_statistics_files()
+        except Exception as e:
+            print(f"Error saving statistics after sync: {e}")
+
     def save_statistics(self):
         try:
-            data_dir = os.path.dirname(STATS_FILE_PATH)
-            if not os.path.exists(data_dir):
-                os.makedirs(data_dir, exist_ok=True)
-            with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
-                json.dump(self.attribute_statistics, f, ensure_ascii=False, indent=4)
+            self.write_statistics_files()
             self.status_bar.configure(text=f"统计数据已保存到 {STATS_FILE_PATH}.")
         except Exception as e:
             self.status_bar.configure(text=f"保存失败: {e}.")
@@ -222,6 +402,33 @@ class MainApp(ctk.CTk):
             self.attribute_statistics = defaultdict(int)
             print("No statistics file found. Starting with empty stats.")
 
+        self.synced_statistics = {} # "server_url|user_id" -> {attribute: count} already queued/sent
+        if os.path.exists(SYNCED_STATS_FILE_PATH):
+            try:
+                with open(SYNCED_STATS_FILE_PATH, 'r', encoding='utf-8') as f:
+                    self.synced_statistics = json.load(f)
+            except Exception as e:
+                print(f"Error loading synced statistics: {e}. Treating local statistics as not uploaded.")
+
+    def save_sync_queue(self):
+        try:
+            data_dir = os.path.dirname(SYNC_QUEUE_FILE_PATH)
+            if not os.path.exists(data_dir):
+                os.makedirs(data_dir, exist_ok=True)
+            with open(SYNC_QUEUE_FILE_PATH, 'w', encoding='utf-8') as f:
+                json.dump(self.sync_queue, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            print(f"Error saving sync queue: {e}")
+
+    def load_sync_queue(self):
+        self.sync_queue = []
+        if os.path.exists(SYNC_QUEUE_FILE_PATH):
+            try:
+                with open(SYNC_QUEUE_FILE_PATH, 'r', encoding='utf-8') as f:
+                    self.sync_queue = json.load(f)
+            except Exception as e:
+                print(f"Error loading sync queue: {e}. Starting with an empty sync queue.")
+
 
 if __name__ == "__main__":
     app = MainApp()
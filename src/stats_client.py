@@ -0,0 +1,97 @@
+import requests
+from urllib.parse import quote
+from stats_protocol import MAX_BATCHES_PER_REQUEST, MAX_ROLLS_PER_ATTRIBUTE
+
+
+def split_into_batches(statistics: dict) -> list:
+    """
+    Splits counts ({attribute: count}) into batches the server accepts, i.e. with
+    at most MAX_ROLLS_PER_ATTRIBUTE of each attribute per batch.
+    """
+    remaining = {attr: count for attr, count in statistics.items() if count > 0}
+    batches = []
+    while remaining:
+        batch = {attr: min(count, MAX_ROLLS_PER_ATTRIBUTE) for attr, count in remaining.items()}
+        batches.append(batch)
+        remaining = {attr: count - batch[attr] for attr, count in remaining.items() if count > batch[attr]}
+    return batches
+
+
+def push_batches(server_url: str, user_id: str, batches: list):
+    """
+    Sends roll batches to the aggregation server, MAX_BATCHES_PER_REQUEST per request.
+    Returns (handled, rejected, error): handled is how many leading batches are done
+    with and can leave the caller's queue; rejected lists those among them the server
+    refused with 400, which were NOT applied; error is the last error message or None.
+    Network errors and other failures stop early so the rest can be retried later.
+    """
+    handled = 0
+    rejected = []
+    error = None
+    for start in range(0, len(batches), MAX_BATCHES_PER_REQUEST):
+        chunk = batches[start:start + MAX_BATCHES_PER_REQUEST]
+        status, message = _post_rolls(server_url, user_id, chunk)
+        if status == 400 and len(chunk) > 1:
+            # The server refuses a whole request over one bad batch; resend singly to keep the good ones
+            for batch in chunk:
+                status, message = _post_rolls(server_url, user_id, [batch])
+                if status == 400:
+                    rejected.append(batch)
+                    error = message
+                elif status != 200:
+                    return handled, rejected, message
+                handled += 1
+            continue
+        if status == 400:
+            rejected.extend(chunk)
+            error = message
+        elif status != 200:
+            return handled, rejected, message
+        handled += len(chunk)
+    return handled, rejected, error
+
+
+def _post_rolls(server_url: str, user_id: str, batches: list):
+    """Returns (status, error message); status is None when the server couldn't be reached."""
+    try:
+        response = requests.post(f"{server_url.rstrip('/')}/rolls",
+                                 json={"user": user_id, "rolls": batches}, timeout=10)
+    except requests.exceptions.Timeout:
+        return None, "Network Error: The request to the stats server timed out."
+    except requests.exceptions.RequestException as e:
+        return None, f"Network Error: {e}"
+    if response.status_code != 200:
+        return response.status_code, f"Sync Error: {_error_message(response)}"
+    return 200, None
+
+
+def fetch_stats(server_url: str, user_id: str | None = None, etag: str | None = None):
+    """
+    Fetches the aggregate distribution, or one user's if user_id is given.
+    Returns (data, etag, error). data is None when the server answered 304 for
+    the given etag, meaning the caller's cached copy is still current.
+    """
+    url = f"{server_url.rstrip('/')}/stats"
+    if user_id:
+        url += f"/users/{quote(user_id, safe='')}"
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        response = requests.get(url, headers=headers, timeout=10)
+        if response.status_code == 304:
+            return None, etag, None
+        if response.status_code != 200:
+            return None, None, f"Sync Error: {_error_message(response)}"
+        return response.json(), response.headers.get("ETag"), None
+    except requests.exceptions.Timeout:
+        return None, None, "Network Error: The request to the stats server timed out."
+    except requests.exceptions.RequestException as e:
+        return None, None, f"Network Error: {e}"
+    except ValueError:
+        return None, None, "Sync Error: Server returned invalid JSON."
+
+
+def _error_message(response) -> str:
+    try:
+        return response.json().get("error", f"HTTP Status {response.status_code}")
+    except ValueError:
+        return response.text or f"HTTP Status {response.status_code}"
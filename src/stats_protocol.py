@@ -0,0 +1,15 @@
+# Limits shared by the stats server and its clients, kept here so MainApp
+# doesn't have to import the server just to stay within them.
+
+MAX_USER_ID_LENGTH = 64
+MAX_ROLLS_PER_ATTRIBUTE = 5  # Batch-size limit per attribute; larger counts are split into several batches
+MAX_BATCHES_PER_REQUEST = 100
+
+
+def check_user_id(user_id) -> str | None:
+    """Returns why the server would reject user_id, or None if it is valid."""
+    if not isinstance(user_id, str) or not user_id.strip():
+        return "Field 'user' must be a non-empty string."
+    if len(user_id.strip()) > MAX_USER_ID_LENGTH:
+        return f"Field 'user' must be at most {MAX_USER_ID_LENGTH} characters."
+    return None
@@ -0,0 +1,650 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from attributes import ATTRIBUTE_DATA
+from attribute_parser import parse_ocr_text
+from config_manager import load_api_key
+from ocr_service import perform_ocr
+from stats_protocol import MAX_BATCHES_PER_REQUEST, MAX_ROLLS_PER_ATTRIBUTE, check_user_id
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SNAPSHOT_DIR = "data/server_stats"  # One JSON file per shard
+NUM_SHARDS = 16
+SNAPSHOT_INTERVAL = 30.0  # Seconds between snapshots of dirty shards
+OCR_CONCURRENCY = 4  # OCR.space requests in flight at once
+OCR_QUEUE_LIMIT = 64  # Image uploads allowed to wait for an OCR slot
+MAX_BODY_SIZE = 5 * 1024 * 1024  # Raw images included
+KEEP_ALIVE_TIMEOUT = 15.0
+
+IMAGE_SUFFIXES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/bmp": ".bmp",
+    "image/gif": ".gif",
+}
+
+HTTP_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: dict | None = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def build_distribution(counts: dict) -> dict:
+    """Turns raw attribute counts into the count/percentage layout shown in the app."""
+    total = sum(counts.values())
+    attributes = {}
+    for attr, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        percentage = (count / total * 100) if total > 0 else 0
+        attributes[attr] = {"count": count, "percentage": round(percentage, 2)}
+    return {"total": total, "attributes": attributes}
+
+
+def validate_user_id(user_id) -> str:
+    error = check_user_id(user_id)
+    if error:
+        raise HTTPError(400, error)
+    return user_id.strip()
+
+
+def validate_rolls(rolls) -> dict:
+    """
+    Checks a parsed roll batch ({attribute: count}) against ATTRIBUTE_DATA and the
+    per-batch size limit. Rejects the whole batch on the first bad entry so nothing
+    is half-applied. This bounds batch size only; it does not limit how much a
+    client can submit in total.
+    """
+    if not isinstance(rolls, dict):
+        raise HTTPError(400, "Each roll batch must be an object of {attribute: count}.")
+    cleaned = {}
+    for attr, count in rolls.items():
+        if attr not in ATTRIBUTE_DATA:
+            raise HTTPError(400, f"Unknown attribute: {attr}")
+        # bool is an int subclass, but True is never a meaningful count
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise HTTPError(400, f"Count for {attr} must be a non-negative integer.")
+        if count > MAX_ROLLS_PER_ATTRIBUTE:
+            raise HTTPError(400, f"Count for {attr} exceeds {MAX_ROLLS_PER_ATTRIBUTE} per batch.")
+        if count:
+            cleaned[attr] = count
+    return cleaned
+
+
+def _is_ocr_error(ocr_text: str) -> bool:
+    # Same prefixes MainApp checks; perform_ocr reports failures as text
+    return (not ocr_text
+            or ocr_text.startswith("OCR Error")
+            or ocr_text.startswith("Network Error:")
+            or ocr_text.startswith("Error"))
+
+
+def _ocr_image_bytes(ocr_func, image_bytes: bytes, suffix: str, api_key: str) -> str:
+    """Runs in the OCR thread pool: perform_ocr wants a path, so spill to a temp file."""
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, prefix="echo_upload_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image_bytes)
+        return ocr_func(temp_path, api_key)
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def _write_file_atomic(path: str, payload: str):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+
+
+class StatsShard:
+    """
+    Per-user counters for the users hashed onto this shard.
+    Each shard is snapshotted to its own file, so a burst of uploads from a few
+    users only rewrites the shards they live on.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.users = {}  # user_id -> defaultdict(int) of attribute counts
+        self.user_versions = defaultdict(int)
+        self.dirty = False
+        self._rendered = {}  # user_id -> (version, body, etag)
+
+    def add_rolls(self, user_id: str, rolls: dict):
+        counts = self.users.setdefault(user_id, defaultdict(int))
+        for attr, count in rolls.items():
+            counts[attr] += count
+        self.user_versions[user_id] += 1
+        self.dirty = True
+
+    def render_user(self, user_id: str):
+        """Returns (body, etag) for one user, or None if the user has no data."""
+        if user_id not in self.users:
+            return None
+        version = self.user_versions[user_id]
+        cached = self._rendered.get(user_id)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+        payload = build_distribution(self.users[user_id])
+        payload["user"] = user_id
+        body, etag = _encode_json(payload)
+        self._rendered[user_id] = (version, body, etag)
+        return body, etag
+
+    def to_json(self) -> str:
+        return json.dumps({"shard": self.index, "users": self.users}, ensure_ascii=False, indent=4)
+
+
+def _encode_json(payload: dict):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    # Content hash keeps ETags valid across server restarts
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    return body, etag
+
+
+class StatsStore:
+    """Sharded in-memory statistics plus a running aggregate across all users."""
+
+    def __init__(self, num_shards: int = NUM_SHARDS, snapshot_dir: str = SNAPSHOT_DIR):
+        self.num_shards = num_shards
+        self.snapshot_dir = snapshot_dir
+        self.shards = [StatsShard(i) for i in range(num_shards)]
+        self.totals = defaultdict(int)
+        self.version = 0
+        self._rendered_aggregate = None  # (version, body, etag)
+        self._prune_stale_files = False
+
+    def shard_for(self, user_id: str) -> StatsShard:
+        # zlib.crc32 rather than hash(): str hashing is randomised per process,
+        # and shard placement has to survive restarts.
+        return self.shards[zlib.crc32(user_id.encode('utf-8')) % self.num_shards]
+
+    def add_rolls(self, user_id: str, rolls: dict):
+        if not rolls:
+            return
+        self.shard_for(user_id).add_rolls(user_id, rolls)
+        for attr, count in rolls.items():
+            self.totals[attr] += count
+        self.version += 1
+
+    def render_aggregate(self):
+        cached = self._rendered_aggregate
+        if cached and cached[0] == self.version:
+            return cached[1], cached[2]
+        payload = build_distribution(self.totals)
+        payload["users"] = sum(len(shard.users) for shard in self.shards)
+        body, etag = _encode_json(payload)
+        self._rendered_aggregate = (self.version, body, etag)
+        return body, etag
+
+    def render_user(self, user_id: str):
+        return self.shard_for(user_id).render_user(user_id)
+
+    def load_snapshot(self):
+        """Restores counters from the shard files; users are re-hashed in case NUM_SHARDS changed."""
+        paths = sorted(glob.glob(os.path.join(self.snapshot_dir, "shard_*.json")))
+        if not paths:
+            print(f"No snapshot found in {self.snapshot_dir}. Starting with empty stats.")
+            return
+        loaded_users = 0
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Error loading snapshot {path}: {e}. Skipping.")
+                continue
+            source_index = data.get("shard")
+            for user_id, counts in data.get("users", {}).items():
+                shard = self.shard_for(user_id)
+                if shard.index != source_index:
+                    self._prune_stale_files = True
+                if user_id in shard.users:
+                    continue  # Stale duplicate left behind by a reshard
+                shard.users[user_id] = defaultdict(int, counts)
+                for attr, count in counts.items():
+                    self.totals[attr] += count
+                loaded_users += 1
+        if self._prune_stale_files:
+            for shard in self.shards:
+                shard.dirty = True
+        self.version += 1
+        print(f"Loaded statistics for {loaded_users} users from {self.snapshot_dir}.")
+
+    def collect_dirty_shards(self) -> list:
+        """Serialises dirty shards on the event loop so writers never see a half-updated dict."""
+        pending = []
+        for shard in self.shards:
+            if shard.dirty:
+                pending.append((shard.index, shard.to_json()))
+                shard.dirty = False
+        return pending
+
+    def write_snapshot(self, pending: list):
+        """Blocking file I/O; called from a worker thread."""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        for index, payload in pending:
+            _write_file_atomic(os.path.join(self.snapshot_dir, f"shard_{index:03d}.json"), payload)
+        if self._prune_stale_files:
+            for path in glob.glob(os.path.join(self.snapshot_dir, "shard_*.json")):
+                match = re.search(r"shard_(\d+)\.json$", path)
+                if match and int(match.group(1)) >= self.num_shards:
+                    os.remove(path)
+            self._prune_stale_files = False
+
+
+class StatsServer:
+    def __init__(self, store: StatsStore, api_key: str | None = None,
+                 ocr_concurrency: int = OCR_CONCURRENCY, ocr_queue_limit: int = OCR_QUEUE_LIMIT,
+                 snapshot_interval: float = SNAPSHOT_INTERVAL, ocr_func=perform_ocr):
+        self.store = store
+        self.api_key = api_key
+        self.ocr_func = ocr_func  # (image_path, api_key) -> text, same contract as perform_ocr
+        self.snapshot_interval = snapshot_interval
+        self.ocr_queue_limit = ocr_queue_limit
+        self._ocr_semaphore = asyncio.Semaphore(ocr_concurrency)
+        self._ocr_executor = ThreadPoolExecutor(max_workers=ocr_concurrency, thread_name_prefix="ocr")
+        self._ocr_pending = 0
+        self._snapshot_lock = asyncio.Lock()
+        self._connections = {}  # handler task -> writer, so shutdown can close idle keep-alives
+
+    # --- Routing ---
+
+    async def dispatch(self, method: str, path: str, query: dict, headers: dict, body: bytes):
+        """Returns (status, body, extra_headers)."""
+        if path == "/health":
+            self._require_method(method, "GET")
+            return 200, b'{"status": "ok"}', {}
+        if path == "/stats":
+            self._require_method(method, "GET")
+            return self._conditional_response(headers, self.store.render_aggregate())
+        if path.startswith("/stats/users/"):
+            self._require_method(method, "GET")
+            user_id = validate_user_id(unquote(path[len("/stats/users/"):]))
+            rendered = self.store.render_user(user_id)
+            if rendered is None:
+                raise HTTPError(404, f"No statistics for user {user_id}.")
+            return self._conditional_response(headers, rendered)
+        if path == "/rolls":
+            self._require_method(method, "POST")
+            return self._handle_rolls(body)
+        if path == "/images":
+            self._require_method(method, "POST")
+            return await self._handle_image(query, headers, body)
+        raise HTTPError(404, f"No route for {path}")
+
+    @staticmethod
+    def _require_method(method: str, allowed: str):
+        if method != allowed:
+            raise HTTPError(405, f"Use {allowed} for this endpoint.", {"Allow": allowed})
+
+    @staticmethod
+    def _conditional_response(headers: dict, rendered):
+        body, etag = rendered
+        extra = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return 304, b"", extra
+        return 200, body, extra
+
+    def _handle_rolls(self, body: bytes):
+        """
+        Accepts {"user": ..., "rolls": {attr: count}} or a list of such batches
+        under "rolls", all applied together.
+        """
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise HTTPError(400, "Request body must be UTF-8 JSON.")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object.")
+        user_id = validate_user_id(data.get("user"))
+        batches = data.get("rolls")
+        if not isinstance(batches, list):
+            batches = [batches]
+        if len(batches) > MAX_BATCHES_PER_REQUEST:
+            raise HTTPError(400, f"At most {MAX_BATCHES_PER_REQUEST} roll batches per request.")
+
+        merged = defaultdict(int)
+        for batch in batches:
+            for attr, count in validate_rolls(batch).items():
+                merged[attr] += count
+        self.store.add_rolls(user_id, merged)
+        accepted = sum(merged.values())
+        return 200, _encode_json({"user": user_id, "accepted": accepted})[0], {}
+
+    async def _handle_image(self, query: dict, headers: dict, body: bytes):
+        user_id = validate_user_id(query.get("user", [None])[0])
+        if not body:
+            raise HTTPError(400, "Request body must contain the image bytes.")
+        api_key = headers.get("x-ocr-api-key") or self.api_key
+        if not api_key or api_key == "YOUR_API_KEY_HERE":
+            raise HTTPError(400, "No OCR.space API Key configured on the server; send X-OCR-API-Key.")
+        if self._ocr_pending >= self.ocr_queue_limit:
+            raise HTTPError(503, "OCR queue is full, try again later.", {"Retry-After": "5"})
+
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        suffix = IMAGE_SUFFIXES.get(content_type, ".png")
+
+        self._ocr_pending += 1
+        try:
+            async with self._ocr_semaphore:
+                loop = asyncio.get_running_loop()
+                ocr_text_result = await loop.run_in_executor(
+                    self._ocr_executor, _ocr_image_bytes, self.ocr_func, body, suffix, api_key)
+        finally:
+            self._ocr_pending -= 1
+
+        if _is_ocr_error(ocr_text_result):
+            raise HTTPError(502, ocr_text_result or "OCR returned no text.")
+
+        # Same checks as /rolls, so an image can't add more than one batch may
+        found_attributes = validate_rolls(parse_ocr_text(ocr_text_result))
+        self.store.add_rolls(user_id, found_attributes)
+        payload = {"user": user_id, "rolls": found_attributes, "accepted": sum(found_attributes.values())}
+        return 200, _encode_json(payload)[0], {}
+
+    # --- HTTP/1.1 connection handling ---
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except HTTPError as e:
+                    await self._write_response(writer, e.status, _error_body(e.message), e.headers, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                keep_alive = _wants_keep_alive(version, headers)
+
+                split = urlsplit(target)
+                try:
+                    status, response_body, extra = await self.dispatch(
+                        method, split.path, parse_qs(split.query), headers, body)
+                except HTTPError as e:
+                    status, response_body, extra = e.status, _error_body(e.message), e.headers
+                except Exception as e:
+                    print(f"Unhandled error for {method} {target}: {e}")
+                    status, response_body, extra = 500, _error_body("Internal server error."), {}
+
+                await self._write_response(writer, status, response_body, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # Idle keep-alive, client went away mid-request, or reset
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass  # Cancelled while the server shuts down; the socket is closed either way
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None  # Clean close between requests
+            raise
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "Request headers too large.")
+
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(411, "Chunked bodies are not supported; send Content-Length.")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length.")
+        if length < 0:
+            raise HTTPError(400, "Invalid Content-Length.")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, f"Request body exceeds {MAX_BODY_SIZE} bytes.")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, version, headers, body
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, body: bytes,
+                              extra_headers: dict, keep_alive: bool):
+        header_lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+        if status != 304:
+            # RFC 9110: a 304 must not claim a length other than the 200 body's, so omit both
+            header_lines.append("Content-Type: application/json; charset=utf-8")
+            header_lines.append(f"Content-Length: {len(body)}")
+        header_lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        for name, value in extra_headers.items():
+            header_lines.append(f"{name}: {value}")
+        writer.write(("\r\n".join(header_lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    # --- Snapshotting ---
+
+    async def snapshot(self):
+        async with self._snapshot_lock:
+            pending = self.store.collect_dirty_shards()
+            if not pending:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.store.write_snapshot, pending)
+            except Exception as e:
+                # Put the shards back so the next tick retries them
+                for index, _ in pending:
+                    self.store.shards[index].dirty = True
+                print(f"Error writing snapshot to {self.store.snapshot_dir}: {e}")
+
+    async def snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def close_connections(self):
+        """Closes open keep-alive connections; each handler then sees EOF and exits on its own."""
+        for writer in list(self._connections.values()):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=KEEP_ALIVE_TIMEOUT)
+
+    async def close(self):
+        await self.close_connections()
+        await self.snapshot()
+        self._ocr_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _error_body(message: str) -> bytes:
+    return json.dumps({"error": message}, ensure_ascii=False).encode('utf-8')
+
+
+def _wants_keep_alive(version: str, headers: dict) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version.upper() == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, num_shards: int = NUM_SHARDS,
+                snapshot_dir: str = SNAPSHOT_DIR, snapshot_interval: float = SNAPSHOT_INTERVAL,
+                ocr_concurrency: int = OCR_CONCURRENCY, api_key: str | None = None, ready=None):
+    """Runs the aggregation server until cancelled. `ready` (an asyncio.Event) is set once listening."""
+    store = StatsStore(num_shards=num_shards, snapshot_dir=snapshot_dir)
+    store.load_snapshot()
+    stats_server = StatsServer(store, api_key=api_key, ocr_concurrency=ocr_concurrency,
+                               snapshot_interval=snapshot_interval)
+
+    server = await asyncio.start_server(stats_server.handle_connection, host, port, backlog=4096)
+    snapshot_task = asyncio.create_task(stats_server.snapshot_periodically())
+    print(f"Echo stats server listening on http://{host}:{port} ({num_shards} shards)")
+    if ready is not None:
+        ready.set()
+    try:
+        # Not serve_forever(): from Python 3.12 its cancellation waits for every open
+        # connection to finish, before we'd get the chance to close idle keep-alives.
+        await asyncio.Event().wait()
+    finally:
+        snapshot_task.cancel()
+        server.close()  # Stop accepting first
+        if hasattr(server, "close_clients"):  # Python 3.13+
+            server.close_clients()
+        await stats_server.close()
+        await server.wait_closed()
+        print(f"Statistics snapshotted to {snapshot_dir}.")
+
+
+def _expect_http_error(status: int, func, *args):
+    try:
+        func(*args)
+    except HTTPError as e:
+        assert e.status == status, f"expected {status}, got {e.status}: {e.message}"
+        return e
+    raise AssertionError(f"expected HTTPError {status} from {func.__name__}{args}")
+
+
+async def _run_self_test():
+    import threading
+
+    print("Testing validate_rolls rejections...")
+    assert validate_rolls({"暴击率": 2, "固定攻击": 0}) == {"暴击率": 2}
+    for bad_rolls in ({"无效属性": 1}, {"暴击率": -1}, {"暴击率": 1.5}, {"暴击率": True},
+                      {"暴击率": MAX_ROLLS_PER_ATTRIBUTE + 1}, {"暴击率": 10 ** 22}, ["暴击率"]):
+        _expect_http_error(400, validate_rolls, bad_rolls)
+
+    with tempfile.TemporaryDirectory(prefix="echo_stats_selftest_") as snapshot_dir:
+        print("Testing ETag / If-None-Match...")
+        server = StatsServer(StatsStore(snapshot_dir=snapshot_dir))
+        too_many = json.dumps({"user": "a", "rolls": [{"暴击率": 1}] * (MAX_BATCHES_PER_REQUEST + 1)}).encode('utf-8')
+        _expect_http_error(400, server._handle_rolls, too_many)
+        server._handle_rolls(json.dumps({"user": "a", "rolls": {"暴击率": 1}}).encode('utf-8'))
+        for path in ("/stats", "/stats/users/a"):
+            status, _, headers = await server.dispatch("GET", path, {}, {}, b"")
+            etag = headers["ETag"]
+            status, body, _ = await server.dispatch("GET", path, {}, {"if-none-match": etag}, b"")
+            assert status == 304 and body == b"", f"{path}: expected 304, got {status}"
+            server._handle_rolls(json.dumps({"user": "a", "rolls": {"暴击伤害": 1}}).encode('utf-8'))
+            status, _, headers = await server.dispatch("GET", path, {}, {"if-none-match": etag}, b"")
+            assert status == 200 and headers["ETag"] != etag, f"{path}: ETag did not change after a write"
+
+        print("Testing load_snapshot after a shard count change...")
+        store = StatsStore(num_shards=16, snapshot_dir=snapshot_dir)
+        users = {f"user-{i}": {"暴击率": i % 5 + 1, "共鸣效率": 1} for i in range(40)}
+        for user_id, rolls in users.items():
+            store.add_rolls(user_id, rolls)
+        store.write_snapshot(store.collect_dirty_shards())
+        expected_totals = dict(store.totals)
+        assert any(int(re.search(r"(\d+)", os.path.basename(path)).group(1)) >= 4
+                   for path in glob.glob(os.path.join(snapshot_dir, "shard_*.json")))
+
+        resharded = StatsStore(num_shards=4, snapshot_dir=snapshot_dir)
+        resharded.load_snapshot()
+        assert dict(resharded.totals) == expected_totals
+        assert sum(len(shard.users) for shard in resharded.shards) == len(users)
+        for user_id, rolls in users.items():
+            assert dict(resharded.shard_for(user_id).users[user_id]) == rolls
+        resharded.write_snapshot(resharded.collect_dirty_shards())
+        remaining = sorted(os.path.basename(path) for path in glob.glob(os.path.join(snapshot_dir, "shard_*.json")))
+        assert remaining == [f"shard_{i:03d}.json" for i in range(4)], f"stale shard files left: {remaining}"
+        reloaded = StatsStore(num_shards=4, snapshot_dir=snapshot_dir)
+        reloaded.load_snapshot()
+        assert dict(reloaded.totals) == expected_totals
+
+        print("Testing 503 when the OCR queue is full...")
+        release = threading.Event()
+        server = StatsServer(StatsStore(snapshot_dir=snapshot_dir), api_key="test",
+                             ocr_concurrency=1, ocr_queue_limit=1,
+                             ocr_func=lambda image_path, api_key: release.wait(5) and "暴击率 8.1%")
+        first = asyncio.create_task(server.dispatch("POST", "/images", {"user": ["a"]}, {}, b"image"))
+        await asyncio.sleep(0.05)  # Let the first upload take the only queue slot
+        try:
+            await server.dispatch("POST", "/images", {"user": ["b"]}, {}, b"image")
+            raise AssertionError("expected 503 while the OCR queue is full")
+        except HTTPError as e:
+            assert e.status == 503 and "Retry-After" in e.headers
+        release.set()
+        status, body, _ = await first
+        assert status == 200 and json.loads(body)["rolls"] == {"暴击率": 1}
+        await server.close()
+
+        print("Testing /images applies the same batch limits as /rolls...")
+        over_cap_text = "\n".join(["暴击率 8.1%"] * (MAX_ROLLS_PER_ATTRIBUTE + 1))
+        server = StatsServer(StatsStore(snapshot_dir=snapshot_dir), api_key="test",
+                             ocr_func=lambda image_path, api_key: over_cap_text)
+        try:
+            await server.dispatch("POST", "/images", {"user": ["a"]}, {}, b"image")
+            raise AssertionError("expected 400 for an OCR result over the batch limit")
+        except HTTPError as e:
+            assert e.status == 400
+        assert server.store.render_user("a") is None
+        await server.close()
+
+    print("All stats_server self-tests passed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregates echo roll statistics from many MainApp users.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS)
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL)
+    parser.add_argument("--ocr-concurrency", type=int, default=OCR_CONCURRENCY)
+    parser.add_argument("--self-test", action="store_true", help="Run the built-in checks and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        asyncio.run(_run_self_test())
+        return
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.shards, args.snapshot_dir,
+                          args.snapshot_interval, args.ocr_concurrency, api_key=load_api_key()))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+
+if __name__ == '__main__':
+    main()